@@ -83,7 +83,7 @@ const ProcessLinks = () => {
     window.URL.revokeObjectURL(url);
   };
 
-  const getAnswer = async (index = null) => {
+  const getAnswer = async (index = null, editedQuery = null) => {
     if (!userId) {
         alert("User ID is missing. Please sign in again.");
         return;
@@ -107,7 +107,8 @@ const ProcessLinks = () => {
     setLoading(true);
 
     try {
-        const currentQuery = index === null ? query : chatHistory[index].content;
+        const currentQuery = index === null ? query : (editedQuery ?? chatHistory[index].content);
+        const turn = index === null ? chatHistory.length : index;  // Conversation position used to scope the retrieval cache
 
         const response = await fetch('http://127.0.0.1:5001/get_answer', {
             method: 'POST',
@@ -118,6 +119,7 @@ const ProcessLinks = () => {
                 query: currentQuery,
                 chatHistory,
                 request_id,
+                turn,
                 user_id: userId  // Add user_id to request body
             }),
         });
@@ -176,7 +178,7 @@ const ProcessLinks = () => {
       return updatedHistory;
     });
     setEditingIndex(null);
-    getAnswer(index);
+    getAnswer(index, editedContent);
   };
 
   const handleRegenerate = (index) => {
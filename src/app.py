@@ -19,6 +19,8 @@ import tempfile
 import docx2txt
 import PyPDF2
 import uuid
+import requests
+from recrawl import RecrawlStore, RecrawlScheduler
 
 # Load environment variables from .env file
 load_dotenv()
@@ -31,6 +33,9 @@ pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
 index_name = 'example-index101'
 user_index_name = 'example-index'  # Index for storing user data
 
+# Answer service whose retrieval cache must be invalidated when a knowledge base changes
+answer_service_url = os.getenv("ANSWER_SERVICE_URL", "http://127.0.0.1:5001")
+
 # Flask application setup
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "http://localhost:3000"}})
@@ -99,6 +104,14 @@ def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
 
+# Notify the answer service that a user's knowledge base changed so cached retrievals are dropped
+def invalidate_retrieval_cache(user_id):
+    try:
+        requests.post(f"{answer_service_url}/invalidate_retrieval_cache", json={"user_id": user_id}, timeout=2)
+    except requests.RequestException as e:
+        print(f"Error invalidating retrieval cache for user_id {user_id}: {e}")
+
+
 def upsert_embeddings_to_pinecone(chunks, embeddings, user_id, document_id, document_name):
     # Generate unique IDs for each embedding, incorporating user_id and document_id for traceability
     batched_embeddings = [
@@ -126,11 +139,12 @@ def upsert_embeddings_to_pinecone(chunks, embeddings, user_id, document_id, docu
             print(f"Index '{index_name}' created successfully.")
         except pinecone.core.openapi.shared.exceptions.PineconeApiException as e:
             print(f"Error creating index '{index_name}': {e}")
-            return
+            return False
 
     # Connect to Pinecone index and upsert embeddings with user-specific metadata
     index = pc.Index(index_name)
     batch_size = 100
+    upserted = True
     for chunk in batch(batched_embeddings, batch_size):
         try:
             # Specify the namespace as the user_id for isolation
@@ -138,8 +152,11 @@ def upsert_embeddings_to_pinecone(chunks, embeddings, user_id, document_id, docu
             print(f"Batch of {len(chunk)} embeddings upserted to Pinecone successfully for user_id: {user_id}.")
         except Exception as e:
             print(f"Error upserting embeddings to Pinecone: {e}")
+            upserted = False
     
     print(f"{len(batched_embeddings)} embeddings upserted for user_id: {user_id} and document_id: {document_id} successfully.")
+    invalidate_retrieval_cache(user_id)
+    return upserted
 
 
 
@@ -234,8 +251,16 @@ def process_links():
         # Check for duplicates (optional: implement check_document_exists if needed)
         if check_document_exists(user_id, document_name):
             duplicate_urls.append(url)
+            # Start tracking URLs ingested before recrawling existed, keeping their stored document_id
+            if recrawl_scheduler.store.get(user_id, url) is None:
+                existing_document_id = get_document_id(user_id, document_name)
+                if existing_document_id:
+                    recrawl_scheduler.record(user_id, url, existing_document_id, recrawl_scheduler.fetch_baseline(url))
             continue  # Skip processing for duplicate URLs
 
+        # Capture validators and content hash before scraping so later changes are detected by the recrawler
+        baseline = recrawl_scheduler.fetch_baseline(url)
+
         # Scrape content for each unique URL
         content = scrape_full_content(url)
         if not content:  # Skip if content is empty
@@ -249,7 +274,12 @@ def process_links():
         embeddings = generate_embeddings(chunks)
 
         # Upsert embeddings with metadata to Pinecone
-        upsert_embeddings_to_pinecone(chunks, embeddings, user_id, document_id, document_name)
+        upserted = upsert_embeddings_to_pinecone(chunks, embeddings, user_id, document_id, document_name)
+
+        # Track the URL so scheduled recrawls can detect changes with conditional requests,
+        # but only once it is fully stored; otherwise a matching hash would hide the missing content
+        if upserted:
+            recrawl_scheduler.record(user_id, url, document_id, baseline)
 
         # Collect chunks and embeddings for the final response
         all_chunks.extend(chunks)
@@ -271,6 +301,99 @@ def process_links():
     }), 200
 
 
+# Look up the document_id stored for a document name, or None if it is not in the knowledge base
+def get_document_id(user_id, document_name):
+    index = pc.Index(index_name)
+    query_results = index.query(
+        vector=[0.0] * 1536,  # Dummy vector
+        top_k=1,
+        filter={"user_id": user_id, "document_name": document_name},
+        namespace=user_id,
+        include_metadata=True
+    )
+    matches = query_results.get("matches", [])
+    return matches[0].get("metadata", {}).get("document_id") if matches else None
+
+
+# Look up the IDs of every vector stored for a document
+def get_document_vector_ids(user_id, document_id):
+    index = pc.Index(index_name)
+    query_results = index.query(
+        vector=[0.0] * 1536,  # Dummy vector since we only want IDs
+        top_k=10000,
+        filter={"document_id": document_id},
+        namespace=user_id,
+        include_values=False
+    )
+    return [match['id'] for match in query_results.get("matches", [])]
+
+
+def delete_vectors(user_id, vector_ids):
+    index = pc.Index(index_name)
+    for id_batch in batch(vector_ids, 1000):
+        index.delete(ids=id_batch, namespace=user_id)
+
+
+# Scrape, embed and upsert a URL for the recrawl scheduler, replacing the previous version if document_id is given.
+# Returns the document_id the page is stored under, or None if the page was not ingested.
+def ingest_url(user_id, url, document_id=None):
+    document_name = url
+    if not document_id:
+        # Pages discovered by the crawler may already have been added through /process_links; track them as they are
+        existing_document_id = get_document_id(user_id, document_name)
+        if existing_document_id:
+            return existing_document_id
+
+    content = scrape_full_content(url)
+    if not content:
+        return None
+
+    chunks = split_into_chunks(content)
+    embeddings = generate_embeddings(chunks)
+
+    # Upsert the new version under a fresh document_id so it never mixes with the old vectors
+    old_vector_ids = get_document_vector_ids(user_id, document_id) if document_id else []
+    new_document_id = str(uuid.uuid4())
+    if not upsert_embeddings_to_pinecone(chunks, embeddings, user_id, new_document_id, document_name):
+        # Keep the old version and remove any partially upserted new vectors
+        delete_vectors(user_id, get_document_vector_ids(user_id, new_document_id))
+        raise RuntimeError(f"Failed to upsert new version of '{document_name}'")
+
+    # The new version is stored, so report it even if cleanup fails; otherwise the next recrawl would
+    # re-ingest under yet another document_id and leave this version behind as a duplicate
+    try:
+        delete_vectors(user_id, old_vector_ids)
+    except Exception as e:
+        print(f"Error deleting old vectors for '{document_name}', orphaned IDs for user_id {user_id}: {old_vector_ids}: {e}")
+    invalidate_retrieval_cache(user_id)  # Old paragraphs may have been cached between upsert and delete
+    return new_document_id
+
+
+# Recrawl scheduler for ingested URLs
+recrawl_scheduler = RecrawlScheduler(
+    RecrawlStore(os.getenv("RECRAWL_STATE_PATH", "recrawl_state.json")),
+    ingest_url,
+    max_depth=int(os.getenv("RECRAWL_MAX_DEPTH", 0)),
+    follow_sitemaps=os.getenv("RECRAWL_FOLLOW_SITEMAPS", "false").lower() == "true",
+    per_domain_limit=int(os.getenv("RECRAWL_PER_DOMAIN_CONCURRENCY", 2)),
+    max_pages=int(os.getenv("RECRAWL_MAX_PAGES", 50))
+)
+
+
+# Route to recrawl a user's ingested URLs on demand
+@app.route('/recrawl', methods=['POST'])
+def recrawl():
+    data = request.get_json()
+    user_id = data.get("user_id")
+    if not user_id:
+        return jsonify({"error": "User ID is required"}), 400
+
+    # Recrawling can take minutes (browser scrapes and embeddings), so run it in the background
+    if not recrawl_scheduler.start_user_recrawl(user_id):
+        return jsonify({"message": "A recrawl is already in progress for this user"}), 409
+    return jsonify({"message": "Recrawl started"}), 202
+
+
 def convert_file_to_text(file_path, file_type):
     try:
         if file_type == "text/plain":  # For .txt files
@@ -474,6 +597,8 @@ def clear_index():
         if vector_ids:
             for id_batch in batch(vector_ids, 1000):
                 index.delete(ids=id_batch, namespace=user_id)  # Send only the batch of IDs
+            invalidate_retrieval_cache(user_id)
+            recrawl_scheduler.store.remove_user(user_id)  # Stop recrawling URLs that were cleared
             return jsonify({"message": "User data cleared successfully.", "status": "cleared"}), 200
         else:
             return jsonify({"message": "No data found for the user.", "status": "empty"}), 200
@@ -512,4 +637,8 @@ def list_documents():
 
 
 if __name__ == '__main__':
+    # Start the recrawl scheduler once, in the reloader's serving process only
+    recrawl_interval = int(os.getenv("RECRAWL_INTERVAL", 0))
+    if recrawl_interval > 0 and os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        recrawl_scheduler.start(recrawl_interval)
     app.run(port=5000, debug=True)
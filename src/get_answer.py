@@ -4,6 +4,7 @@ from dotenv import load_dotenv
 from pinecone import Pinecone, ServerlessSpec
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+from retrieval_cache import RetrievalCache, merge_results
 
 # Load environment variables from .env file
 load_dotenv()
@@ -23,6 +24,13 @@ index = pc.Index(index_name)
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "http://localhost:3000"}})
 
+# Conversation-scoped cache so regenerated and lightly edited queries reuse prior retrieval work
+retrieval_cache = RetrievalCache(
+    ttl=int(os.getenv("RETRIEVAL_CACHE_TTL", 1800)),
+    max_bytes=int(os.getenv("RETRIEVAL_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+    freshness_window=int(os.getenv("RETRIEVAL_CACHE_FRESHNESS_WINDOW", 10))
+)
+
 def generate_embeddings(text):
     # Generate embeddings for the query text using OpenAI
     response = openai.Embedding.create(
@@ -56,13 +64,17 @@ def semantic_search_pinecone(query_embedding, user_id, top_n=6):
             if isinstance(metadata, dict) and "text" in metadata:
                 top_paragraphs.append({
                     "text": metadata["text"],
-                    "document_name": metadata.get("document_name", "Unnamed Document")
+                    "document_name": metadata.get("document_name", "Unnamed Document"),
+                    "score": match.get("score", 0.0),
+                    "id": match.get("id")
                 })
             elif isinstance(metadata, str):
                 # If metadata is a string, use it directly with a default document name
                 top_paragraphs.append({
                     "text": metadata,
-                    "document_name": "Unnamed Document"
+                    "document_name": "Unnamed Document",
+                    "score": match.get("score", 0.0),
+                    "id": match.get("id")
                 })
             else:
                 print(f"Skipping match due to unexpected metadata format: {match}")
@@ -78,6 +90,20 @@ def semantic_search_pinecone(query_embedding, user_id, top_n=6):
         return ["An error occurred while retrieving data."]
 
 
+# Attach stored vectors to cached candidates so they can be re-scored against an edited query
+def fetch_candidate_vectors(results, user_id):
+    ids = [result["id"] for result in results if isinstance(result, dict) and result.get("id")]
+    if not ids:
+        return []
+    try:
+        vectors = index.fetch(ids=ids, namespace=user_id).vectors
+    except Exception as e:
+        print(f"Error fetching candidate vectors: {e}")
+        return []
+    return [dict(result, vector=vectors[result["id"]].values) for result in results
+            if isinstance(result, dict) and result.get("id") in vectors]
+
+
 def construct_answer(query, top_paragraphs):
     messages = [
         {"role": "system", "content": "You are a helpful assistant."},
@@ -118,16 +144,35 @@ def get_answer():
     data = request.get_json()
     query = data.get('query')
     user_id = data.get('user_id')  # Get user_id from request
+    turn = data.get('turn')  # Position of the question in the conversation
     if not query:
         return jsonify({'error': 'Missing query'}), 400
     if not user_id:
         return jsonify({'error': 'Missing user_id'}), 400
 
-    # Generate an embedding for the query
-    query_embedding = generate_embeddings(query)
+    # Reuse the retrieval for this turn if the query is unchanged (e.g. answer regeneration)
+    cached = retrieval_cache.get(user_id, turn, query)
+    if cached:
+        query_embedding, search_results = cached
+    else:
+        # Snapshot the cache generation so a knowledge base change during retrieval discards this result
+        generation = retrieval_cache.generation(user_id)
+
+        # Generate an embedding for the query
+        query_embedding = generate_embeddings(query)
+
+        # Perform semantic search in Pinecone to retrieve relevant paragraphs for the specific user
+        search_results = semantic_search_pinecone(query_embedding, user_id)
+
+        # For a light edit of this turn's query, merge the previous candidates with the fresh search
+        previous_results = retrieval_cache.get_previous(user_id, turn, query)
+        if previous_results and all(isinstance(result, dict) for result in search_results):
+            previous_results = fetch_candidate_vectors(previous_results, user_id)
+            search_results = merge_results(search_results, previous_results, query_embedding)
 
-    # Perform semantic search in Pinecone to retrieve relevant paragraphs for the specific user
-    search_results = semantic_search_pinecone(query_embedding, user_id)
+        # Only cache successful retrievals, not error placeholders
+        if search_results and all(isinstance(result, dict) for result in search_results):
+            retrieval_cache.put(user_id, turn, query, query_embedding, search_results, generation)
 
     # Separate the answer and document name from search results
     top_paragraphs = [result["text"] for result in search_results]  # Modify based on your actual result structure
@@ -143,6 +188,18 @@ def get_answer():
     })
 
 
+@app.route('/invalidate_retrieval_cache', methods=['POST'])
+def invalidate_retrieval_cache():
+    data = request.get_json()
+    user_id = data.get("user_id")
+    if not user_id:
+        return jsonify({"error": "Missing user_id"}), 400
+
+    # Called when the user's knowledge base changes so stale context is not reused
+    retrieval_cache.invalidate_user(user_id)
+    return jsonify({"message": "Retrieval cache invalidated"}), 200
+
+
 @app.route('/clear_user_data', methods=['POST'])
 def clear_user_data():
     data = request.get_json()
@@ -153,6 +210,7 @@ def clear_user_data():
     try:
         # Delete data within the namespace (user-specific data)
         index.delete(delete_all=True, namespace=user_id)
+        retrieval_cache.invalidate_user(user_id)
         return jsonify({"message": "User data cleared successfully"}), 200
     except Exception as e:
         print(f"Error clearing user data for user_id {user_id}: {e}")
@@ -0,0 +1,315 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlparse, urldefrag
+
+import requests
+from bs4 import BeautifulSoup
+
+
+# Extract page text the same way scrape_full_content does, without launching a browser
+def extract_text(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    return ' '.join([p.get_text() for p in soup.find_all(['p', 'h1', 'h2', 'h3', 'span', 'div'])])
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def same_domain(url, other_url):
+    return urlparse(url).netloc == urlparse(other_url).netloc
+
+
+# Collect same-domain links from a page, dropping fragments and non-http schemes
+def extract_links(html, base_url):
+    soup = BeautifulSoup(html, 'html.parser')
+    links = set()
+    for anchor in soup.find_all('a', href=True):
+        link, _ = urldefrag(urljoin(base_url, anchor['href']))
+        if urlparse(link).scheme in ('http', 'https') and same_domain(link, base_url):
+            links.add(link)
+    return links
+
+
+class RecrawlStore:
+    """JSON-backed record of ETag, Last-Modified and content hash for each ingested URL, per user."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._records = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as file:
+                    self._records = json.load(file)
+            except (OSError, ValueError) as e:
+                print(f"Error loading recrawl state from {path}: {e}")
+
+    def get(self, user_id, url):
+        with self._lock:
+            record = self._records.get(user_id, {}).get(url)
+            return dict(record) if record else None
+
+    def set(self, user_id, url, record):
+        with self._lock:
+            self._records.setdefault(user_id, {})[url] = record
+            self._save()
+
+    def urls_for_user(self, user_id):
+        with self._lock:
+            return dict(self._records.get(user_id, {}))
+
+    def users(self):
+        with self._lock:
+            return list(self._records)
+
+    def remove_user(self, user_id):
+        with self._lock:
+            if self._records.pop(user_id, None) is not None:
+                self._save()
+
+    def _save(self):
+        # Write to a temporary file first so a crash never leaves a truncated state file
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(self._records, file)
+        os.replace(temp_path, self.path)
+
+
+class RecrawlScheduler:
+    """Periodically re-checks ingested URLs and re-ingests only the pages whose content changed.
+
+    `ingest_url(user_id, url, document_id)` is called for changed or newly discovered pages and
+    returns the document_id the page is stored under (an existing one for pages already in the
+    knowledge base), or None if it was not ingested.
+    """
+
+    def __init__(self, store, ingest_url, max_depth=0, follow_sitemaps=False, per_domain_limit=2,
+                 max_workers=8, max_pages=50, timeout=15):
+        self.store = store
+        self.ingest_url = ingest_url
+        self.max_depth = max_depth
+        self.follow_sitemaps = follow_sitemaps
+        self.per_domain_limit = per_domain_limit
+        self.max_workers = max_workers
+        self.max_pages = max_pages
+        self.timeout = timeout
+        self._domain_semaphores = {}
+        self._domain_lock = threading.Lock()
+        self._user_locks = {}
+
+    def fetch_baseline(self, url):
+        # Fetch validators, content hash and links before ingesting, so the baseline is never newer than
+        # the ingested content (a change in between is simply re-ingested on the next recrawl)
+        try:
+            response = self._fetch(url, None)
+        except requests.RequestException as e:
+            print(f"Error fetching baseline for {url}: {e}")
+            return {}
+        if response.status_code != 200:
+            return {}
+        return {
+            "content_hash": content_hash(extract_text(response.text)),
+            "links": sorted(extract_links(response.text, url)),
+            **self._validators(response)
+        }
+
+    def record(self, user_id, url, document_id, baseline, depth=0):
+        # Store the baseline for a freshly ingested URL so the next recrawl can be conditional
+        record = {"document_id": document_id, "depth": depth, "etag": None, "last_modified": None,
+                  "content_hash": None, "links": [], "last_checked": time.time()}
+        record.update(baseline)
+        self.store.set(user_id, url, record)
+
+    def recrawl_all(self):
+        summaries = {}
+        for user_id in self.store.users():
+            try:
+                summaries[user_id] = self.recrawl_user(user_id)
+            except Exception as e:
+                print(f"Error recrawling URLs for user_id {user_id}: {e}")
+        return summaries
+
+    def recrawl_user(self, user_id):
+        summary = {"unchanged": [], "updated": [], "added": [], "skipped": [], "failed": []}
+        with self._user_lock(user_id):
+            tracked = self.store.urls_for_user(user_id)
+            frontier = [(url, record.get("depth", 0)) for url, record in tracked.items()]
+            seen = set(tracked)
+
+            if self.follow_sitemaps and self.max_depth > 0:
+                for url in self._sitemap_urls(tracked):
+                    if url not in seen and len(seen) < self.max_pages:
+                        seen.add(url)
+                        frontier.append((url, 1))
+
+            # Breadth-first so each discovered page is crawled at its shallowest depth
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                while frontier:
+                    futures = [(url, depth, executor.submit(self._recrawl_url, user_id, url, depth))
+                               for url, depth in frontier]
+                    frontier = []
+                    for url, depth, future in futures:
+                        outcome, links = future.result()
+                        summary[outcome].append(url)
+                        for link in links:
+                            if link not in seen and len(seen) < self.max_pages:
+                                seen.add(link)
+                                frontier.append((link, depth + 1))
+
+        print(f"Recrawl for user_id {user_id}: " + ", ".join(f"{len(urls)} {outcome}" for outcome, urls in summary.items()))
+        return summary
+
+    def start_user_recrawl(self, user_id):
+        # Recrawl one user on a background thread; returns False if a run for that user is already in progress
+        if self._user_lock(user_id).locked():
+            return False
+
+        def run():
+            try:
+                self.recrawl_user(user_id)
+            except Exception as e:
+                print(f"Error recrawling URLs for user_id {user_id}: {e}")
+
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+    def start(self, interval):
+        # Run recrawl_all every `interval` seconds on a daemon thread
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.recrawl_all()
+                except Exception as e:
+                    print(f"Error during scheduled recrawl: {e}")
+
+        thread = threading.Thread(target=loop, daemon=True)
+        thread.start()
+        return thread
+
+    def _recrawl_url(self, user_id, url, depth):
+        record = self.store.get(user_id, url)
+
+        # Limit concurrent requests per domain for the fetch only; ingesting (embedding, upserting) happens outside
+        with self._domain_semaphore(url):
+            try:
+                response = self._fetch(url, record)
+                # Non-HTML bodies are never read (the response is streamed)
+                is_html = "text/html" in response.headers.get("Content-Type", "")
+                html = response.text if response.status_code == 200 and is_html else None
+                response.close()
+            except requests.RequestException as e:
+                print(f"Error recrawling {url}: {e}")
+                return "failed", []
+
+        # 304 Not Modified: nothing to parse, embed or upsert; follow the links saved from the last 200
+        if response.status_code == 304 and record:
+            record["last_checked"] = time.time()
+            self.store.set(user_id, url, record)
+            return "unchanged", self._links_to_follow(record.get("links", []), depth)
+        if response.status_code != 200:
+            print(f"Unexpected status {response.status_code} recrawling {url}")
+            return "failed", []
+
+        # PDFs, images and other non-HTML links are never scraped; remember their validators so later
+        # runs only send a conditional request
+        if html is None:
+            self._store_skipped(user_id, url, record, depth, None, [], response)
+            return "skipped", []
+
+        new_hash = content_hash(extract_text(html))
+        page_links = sorted(extract_links(html, url))
+        links = self._links_to_follow(page_links, depth)
+
+        if record and record.get("content_hash") == new_hash:
+            record.update(self._validators(response))
+            record["links"] = page_links
+            record["last_checked"] = time.time()
+            self.store.set(user_id, url, record)
+            return "unchanged", links
+
+        # Scraping, embedding and upserting can fail in many ways; one bad page must not abort the run
+        try:
+            document_id = self.ingest_url(user_id, url, record["document_id"] if record else None)
+        except Exception as e:
+            print(f"Error re-ingesting {url} for user_id {user_id}: {e}")
+            return "failed", links
+
+        if not document_id:
+            # e.g. a page built entirely by JavaScript that scrapes empty; only retry once its content changes
+            self._store_skipped(user_id, url, record, depth, new_hash, page_links, response)
+            return "skipped", links
+        self.store.set(user_id, url, {
+            "document_id": document_id,
+            "depth": record.get("depth", depth) if record else depth,
+            "content_hash": new_hash,
+            "links": page_links,
+            "last_checked": time.time(),
+            **self._validators(response)
+        })
+        return ("updated" if record and record.get("document_id") else "added"), links
+
+    def _store_skipped(self, user_id, url, record, depth, page_hash, page_links, response):
+        self.store.set(user_id, url, {
+            "document_id": record.get("document_id") if record else None,
+            "depth": record.get("depth", depth) if record else depth,
+            "content_hash": page_hash,
+            "links": page_links,
+            "last_checked": time.time(),
+            **self._validators(response)
+        })
+
+    def _fetch(self, url, record):
+        headers = {"User-Agent": "Finscribe-Recrawler/1.0"}
+        if record and record.get("etag"):
+            headers["If-None-Match"] = record["etag"]
+        if record and record.get("last_modified"):
+            headers["If-Modified-Since"] = record["last_modified"]
+        return requests.get(url, headers=headers, timeout=self.timeout, stream=True)
+
+    def _links_to_follow(self, links, depth):
+        return links if depth < self.max_depth else []
+
+    def _validators(self, response):
+        return {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+
+    def _user_lock(self, user_id):
+        # Runs for the same user never overlap, but different users (and on-demand runs) do not wait on each other
+        with self._domain_lock:
+            if user_id not in self._user_locks:
+                self._user_locks[user_id] = threading.Lock()
+            return self._user_locks[user_id]
+
+    def _domain_semaphore(self, url):
+        domain = urlparse(url).netloc
+        with self._domain_lock:
+            if domain not in self._domain_semaphores:
+                self._domain_semaphores[domain] = threading.BoundedSemaphore(self.per_domain_limit)
+            return self._domain_semaphores[domain]
+
+    def _sitemap_urls(self, tracked):
+        # Read /sitemap.xml once per tracked domain and keep same-domain page locations
+        urls = []
+        roots = {f"{urlparse(url).scheme}://{urlparse(url).netloc}" for url in tracked}
+        for root in roots:
+            sitemap_url = f"{root}/sitemap.xml"
+            try:
+                response = requests.get(sitemap_url, timeout=self.timeout)
+                if response.status_code != 200:
+                    continue
+                tree = ET.fromstring(response.content)
+            except (requests.RequestException, ET.ParseError) as e:
+                print(f"Error reading sitemap {sitemap_url}: {e}")
+                continue
+            for loc in tree.iter():
+                if loc.tag.endswith('loc') and loc.text:
+                    url = loc.text.strip()
+                    if same_domain(url, root) and not url.endswith('.xml'):
+                        urls.append(url)
+        return urls
@@ -0,0 +1,136 @@
+import re
+import sys
+import time
+import threading
+from array import array
+from collections import OrderedDict
+from difflib import SequenceMatcher
+
+
+# Normalize a query so trivial differences (case, spacing, trailing punctuation) share a cache entry
+def normalize_query(query):
+    query = re.sub(r"\s+", " ", query.strip().lower())
+    return query.rstrip("?!. ")
+
+
+# Store vectors as 4-byte floats instead of Python float lists (~32 bytes per element)
+def compact_vector(vector):
+    return array('f', vector)
+
+
+# In-memory footprint of a cached entry measured on the stored objects, used to enforce the memory cap
+def estimate_entry_size(query_embedding, results):
+    size = sys.getsizeof(query_embedding) + sys.getsizeof(results)
+    for result in results:
+        size += sys.getsizeof(result)
+        if isinstance(result, dict):
+            size += sum(sys.getsizeof(value) for value in result.values())
+    return size
+
+
+class RetrievalCache:
+    """Conversation-scoped cache of query embeddings and retrieved context.
+
+    Entries are keyed by (user_id, turn, normalized query), expire after `ttl`
+    seconds and are evicted least-recently-used first once `max_bytes` is exceeded.
+    For `freshness_window` seconds after an invalidation nothing is cached for that user,
+    since Pinecone may still serve the pre-change results for a short while.
+    """
+
+    def __init__(self, ttl=1800, max_bytes=64 * 1024 * 1024, edit_similarity=0.8, freshness_window=10):
+        self.ttl = ttl
+        self.freshness_window = freshness_window
+        self.max_bytes = max_bytes
+        self.edit_similarity = edit_similarity
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._generations = {}
+        self._invalidated_at = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id, turn, query):
+        # Return (query_embedding, results) for an exact match, or None
+        key = (user_id, turn, normalize_query(query))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._is_expired(entry):
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry["query_embedding"], entry["results"]
+
+    def get_previous(self, user_id, turn, query):
+        # Return the results cached for an earlier version of this turn's query, if it was a light edit
+        tokens = normalize_query(query).split()
+        with self._lock:
+            for key in reversed(self._entries):
+                entry = self._entries[key]
+                if key[0] != user_id or key[1] != turn or self._is_expired(entry):
+                    continue
+                # Compare word by word so changing a key term (e.g. a metric or year) is not a light edit
+                if SequenceMatcher(None, key[2].split(), tokens).ratio() >= self.edit_similarity:
+                    return entry["results"]
+        return None
+
+    def generation(self, user_id):
+        # Read before retrieving; pass to put() so results fetched before an invalidation are not stored
+        with self._lock:
+            return self._generations.get(user_id, 0)
+
+    def put(self, user_id, turn, query, query_embedding, results, generation=None):
+        key = (user_id, turn, normalize_query(query))
+        query_embedding = compact_vector(query_embedding)
+        size = estimate_entry_size(query_embedding, results)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generations.get(user_id, 0):
+                return
+            if time.time() - self._invalidated_at.get(user_id, 0) < self.freshness_window:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {
+                "query_embedding": query_embedding,
+                "results": results,
+                "created_at": time.time(),
+                "size": size,
+            }
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+
+    def invalidate_user(self, user_id):
+        # Drop every entry for a user, e.g. after their knowledge base changes
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            self._invalidated_at[user_id] = time.time()
+            for key in [key for key in self._entries if key[0] == user_id]:
+                self._remove(key)
+
+    def _is_expired(self, entry):
+        return time.time() - entry["created_at"] > self.ttl
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._total_bytes -= entry["size"]
+
+
+# Merge candidates from a previous retrieval with a fresh search, keeping the best-scored unique paragraphs.
+# Previous candidates are re-scored against the new query embedding so both sets are ranked on the same query.
+def merge_results(fresh_results, previous_results, query_embedding, top_n=6):
+    merged = {}
+    for result in fresh_results:
+        if isinstance(result, dict):
+            merged[result.get("text")] = result
+    for result in previous_results:
+        vector = result.get("vector") if isinstance(result, dict) else None
+        if not vector or result.get("text") in merged:
+            continue
+        score = sum(a * b for a, b in zip(vector, query_embedding))
+        merged[result.get("text")] = {key: value for key, value in dict(result, score=score).items() if key != "vector"}
+    ranked = sorted(merged.values(), key=lambda result: result.get("score", 0.0), reverse=True)
+    return ranked[:top_n]